@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import re
 from collections import defaultdict
+from functools import lru_cache
 import io
 import logging
 import sys
@@ -10,13 +11,37 @@ import os
 
 # 로깅 설정
 logging.basicConfig(
-    level=logging.INFO,
+    level=logging.WARNING,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(sys.stdout)
     ]
 )
 
+# 주문 메시지를 작성하는 관리자
+ADMINS = ["만물다잇쏘", "다잇쏘"]
+
+# 상품명에서 제외할 단어 패턴 (주문 수량, 인원 제한 등)
+# 긴 문구가 먼저 매칭되도록 길이순으로 나열 (예: '재고한정' > '한정', '한분만' > '한분')
+_EXCLUDE_RE = re.compile(
+    r'당일배송|익일배송|품절임박|마감임박|재고한정|선착순|한정'
+    r'|(?:한|두|세|네|다섯|여섯|일곱|여덟|아홉|열)분만?'
+    r'|출발',
+    re.IGNORECASE
+)
+# 구매자명 패턴 (한글/영문 + 숫자)
+_BUYER_SUFFIX_RE = re.compile(r'[가-힣a-zA-Z]+\d+(?=\s|$)')
+# 상품명 끝에 붙은 가격
+_TRAILING_PRICE_RE = re.compile(r'\s*\d+원\s*$')
+# 상품 메시지: 상품 번호 + 상품명 + 가격(숫자 + '원')
+# 상품 번호와 구분 문자는 전방탐색 + 역참조(원자 그룹 흉내)로 되돌아가지 않게 하여
+# 긴 숫자 메시지에서도 매칭 시간이 선형으로 유지되도록 함 ('_sep' 컬럼은 추출 후 제거)
+_PRODUCT_RE = re.compile(
+    r'^(?=(?P<상품번호>\d+))(?P=상품번호)(?=(?P<_sep>[\s.]*))(?P=_sep)(?P<상품명>.*?)(?P<판매가>\d{3,6})원'
+)
+# 구매자 이름 패턴 (한글/영문)
+_NAME_PREFIX_RE = re.compile(r'^([가-힣a-zA-Z!~]+)')
+
 def save_buyer_ids(buyer_ids):
     """구매자 아이디를 세션에 저장"""
     st.session_state['buyer_ids'] = list(buyer_ids)
@@ -45,40 +70,9 @@ def load_buyer_ids():
         logging.error(f"구매자 아이디 불러오기 중 오류: {str(e)}")
         return set()
 
+@lru_cache(maxsize=4096)
 def clean_product_name(name):
     """상품명에서 불필요한 문구 제거"""
-    # 제외할 단어 패턴 (주문 수량, 인원 제한 등)
-    exclude_patterns = [
-        r'선착순',
-        r'한정',
-        r'당일배송',
-        r'익일배송',
-        r'품절임박',
-        r'마감임박',
-        r'재고한정',
-        r'한분만',
-        r'한분',
-        r'두분만',
-        r'두분',
-        r'세분만',
-        r'세분',
-        r'네분만',
-        r'네분',
-        r'다섯분만',
-        r'다섯분',
-        r'여섯분만',
-        r'여섯분',
-        r'일곱분만',
-        r'일곱분',
-        r'여덟분만',
-        r'여덟분',
-        r'아홉분만',
-        r'아홉분',
-        r'열분만',
-        r'열분',
-        r'출발'
-    ]
-    
     cleaned_name = name
     
     # '/' 이전의 텍스트만 처리
@@ -86,49 +80,52 @@ def clean_product_name(name):
         cleaned_name = cleaned_name.split('/')[0].strip()
     
     # 제외 패턴 적용
-    for pattern in exclude_patterns:
-        cleaned_name = re.sub(pattern, '', cleaned_name, flags=re.IGNORECASE)
+    cleaned_name = _EXCLUDE_RE.sub('', cleaned_name)
     
     # 구매자명 패턴 제거 (한글/영문 + 숫자)
-    cleaned_name = re.sub(r'[가-힣a-zA-Z]+\d+(?=\s|$)', '', cleaned_name)
+    cleaned_name = _BUYER_SUFFIX_RE.sub('', cleaned_name)
     
     # 연속된 공백 제거 및 앞뒤 공백 제거
-    cleaned_name = ' '.join(cleaned_name.split())
-    return cleaned_name.strip()
+    return ' '.join(cleaned_name.split())
 
-def extract_product_info(msg):
-    """상품 정보(상품 번호, 상품명, 가격) 추출"""
+def _to_int(number):
+    """숫자 문자열을 int로 변환 (변환할 수 없으면 None)"""
     try:
-        # 상품 번호와 내용 분리
-        number_pattern = r'^(\d+)[\s.]*(.+)'
-        number_match = re.match(number_pattern, msg.strip())
-        
-        if not number_match:
-            return None, None, None
-            
-        product_number = int(number_match.group(1))
-        remaining_text = number_match.group(2).strip()
-        
-        # 가격 패턴: 숫자 + '원'
-        price_pattern = r'(\d{3,6})원'
-        price_match = re.search(price_pattern, remaining_text)
-        
-        if price_match:
-            price = int(price_match.group(1))
-            # 가격 이전의 텍스트를 상품명으로
-            product_name = remaining_text[:price_match.start()].strip()
-            
-            # 상품명이 비어있지 않고 가격이 있는 경우
-            if product_name and price:
-                # 상품명 정제 (마지막 가격 부분 제거)
-                product_name = re.sub(r'\s*\d+원\s*$', '', product_name)
-                # 상품명 정제 (불필요한 문구 제거)
-                product_name = clean_product_name(product_name)
-                return product_number, product_name, price
-                
+        return int(number)
+    except ValueError:
+        return None
+
+def extract_product_info(msgs):
+    """상품 정보(상품 번호, 상품명, 가격) 추출
+
+    메시지의 마지막 '/' 이전 부분 Series 전체를 한 번에 처리하여 상품 정보가
+    있는 메시지만 '상품번호', '상품명', '판매가' 컬럼의 데이터프레임으로 반환한다.
+    """
+    try:
+        # 상품 번호, 상품명, 가격(숫자 + '원')을 이름 있는 그룹으로 한 번에 추출
+        products = msgs.str.extract(_PRODUCT_RE).drop(columns="_sep").dropna()
+        # 상품 번호는 파이썬 int로 변환 (int64 범위를 넘으면 object 컬럼으로 유지,
+        # 변환할 수 없는 메시지만 제외)
+        products["상품번호"] = pd.Series(
+            [_to_int(number) for number in products["상품번호"]],
+            index=products.index, dtype=object,
+        )
+        products = products.dropna(subset=["상품번호"]).infer_objects()
+        products = products.astype({"판매가": "int64"})
+
+        # 상품명 정제 (마지막 가격 부분 제거, 불필요한 문구 제거)
+        products["상품명"] = (
+            products["상품명"].str.strip()
+            .str.replace(_TRAILING_PRICE_RE, '', regex=True)
+            .map(clean_product_name)
+        )
+
+        # 상품 번호, 상품명, 가격이 모두 있는 경우만
+        mask = (products["상품번호"] != 0) & (products["상품명"] != "") & (products["판매가"] != 0)
+        return products[mask]
     except Exception as e:
-        logging.error(f"상품 정보 추출 중 오류: {str(e)}, 메시지: {msg}")
-    return None, None, None
+        logging.error(f"상품 정보 추출 중 오류: {str(e)}")
+    return pd.DataFrame(columns=["상품번호", "상품명", "판매가"])
 
 def get_valid_buyers(df, manual_buyer_ids=None):
     """유효한 구매자 목록 생성"""
@@ -138,93 +135,56 @@ def get_valid_buyers(df, manual_buyer_ids=None):
     if manual_buyer_ids:
         buyers.update(manual_buyer_ids)
     
-    for _, row in df.iterrows():
-        msg = str(row["메시지"]).strip() if pd.notna(row["메시지"]) else ""
-        if '/' in msg:
-            # '/' 뒤의 텍스트에서 구매자 찾기
-            order_part = msg.split('/')[-1].strip()
-            parts = order_part.split()
-            
-            for part in parts:
-                found_buyer = None
-                
-                # 먼저 수동으로 입력된 구매자 ID와 일치하는지 확인
-                if manual_buyer_ids:
-                    for buyer_id in manual_buyer_ids:
-                        if part.startswith(buyer_id):
-                            found_buyer = buyer_id
-                            break
-                
-                # 수동 입력된 구매자를 찾지 못한 경우, 일반적인 패턴 확인
-                if not found_buyer:
-                    # 구매자 이름 패턴 (한글/영문)
-                    match = re.match(r'^([가-힣a-zA-Z!~]+)', part)
-                    if match:
-                        buyer = match.group(1).strip()
-                        if buyer:
-                            buyers.add(buyer)
+    # '/' 뒤의 텍스트에서 구매자 찾기
+    msgs = df["메시지"].dropna().astype(str).str.strip()
+    order_parts = msgs[msgs.str.contains('/', regex=False)].str.split('/').str[-1]
+    parts = order_parts.str.split().explode().dropna()
+
+    # 수동으로 입력된 구매자 ID로 시작하는 부분은 제외
+    if manual_buyer_ids:
+        parts = parts[~parts.str.match(build_buyer_pattern(manual_buyer_ids))]
+
+    # 구매자 이름 패턴 (한글/영문)
+    buyers.update(parts.str.extract(_NAME_PREFIX_RE, expand=False).dropna())
     
     return buyers
 
-def parse_order_info(msg, valid_buyers):
-    """주문 정보(구매자와 수량) 추출"""
+def build_buyer_pattern(buyers):
+    """구매자 아이디를 하나의 정규식으로 컴파일 (긴 아이디부터 매칭)"""
+    if not buyers:
+        return None
+    return re.compile('|'.join(re.escape(buyer) for buyer in sorted(buyers, key=len, reverse=True)))
+
+def build_order_pattern(buyers):
+    """구매자 아이디 + 수량(숫자) 주문 정규식 컴파일"""
+    buyer_re = build_buyer_pattern(buyers)
+    if buyer_re is None:
+        return None
+    return re.compile(rf'({buyer_re.pattern})(\d*)')
+
+def parse_order_info(order_part, order_re):
+    """주문 정보(구매자와 수량) 추출 (메시지의 마지막 '/' 뒤 부분을 전달받음)"""
     try:
-        if '/' in msg:
-            order_part = msg.split('/')[-1].strip()
-            orders = []
-            
-            # 현재 처리 중인 문자열
-            remaining_text = order_part
-            
-            while remaining_text:
-                remaining_text = remaining_text.strip()
-                if not remaining_text:
-                    break
-                    
-                found_buyer = None
-                quantity = 1
-                match_length = 0
-                
-                # 1. 먼저 수동으로 입력된 구매자 ID 확인
-                if valid_buyers:
-                    for buyer_id in valid_buyers:
-                        if remaining_text.startswith(buyer_id):
-                            found_buyer = buyer_id
-                            match_length = len(buyer_id)
-                            # 구매자 ID 뒤의 숫자를 수량으로 처리
-                            quantity_match = re.match(r'\d+', remaining_text[match_length:])
-                            if quantity_match:
-                                quantity = int(quantity_match.group())
-                                match_length += len(quantity_match.group())
-                            break
-                
-                # 2. 수동 입력된 구매자를 찾지 못한 경우, 일반적인 패턴 확인
-                if not found_buyer:
-                    # 한글/영문 이름 + 숫자(수량) 패턴
-                    match = re.match(r'([가-힣a-zA-Z!~]+)(\d*)', remaining_text)
-                    if match:
-                        potential_buyer = match.group(1)
-                        if potential_buyer in valid_buyers:
-                            found_buyer = potential_buyer
-                            match_length = len(match.group(1))
-                            if match.group(2):  # 수량이 있는 경우
-                                quantity = int(match.group(2))
-                                match_length += len(match.group(2))
-                
-                if found_buyer:
-                    orders.append((found_buyer, quantity))
-                    remaining_text = remaining_text[match_length:]
-                else:
-                    # 매칭되지 않은 경우, 다음 문자로 이동
-                    remaining_text = remaining_text[1:]
-            
-            return orders
-            
-        return []
+        if not order_re:
+            return []
+        
+        # 정규식 엔진이 한 번에 문자열을 훑으며 구매자 아이디를 찾고,
+        # 일치하지 않는 위치는 한 글자씩 건너뜀 (구매자 ID 뒤의 숫자는 수량)
+        return [
+            (buyer, int(quantity) if quantity else 1)
+            for buyer, quantity in order_re.findall(order_part)
+        ]
     except Exception as e:
-        logging.error(f"주문 정보 파싱 중 오류: {str(e)}, 메시지: {msg}")
+        logging.error(f"주문 정보 파싱 중 오류: {str(e)}, 주문: {order_part}")
         return []
 
+def filter_admin_messages(df):
+    """관리자 메시지만 시간순으로 필터링"""
+    df = df[df["사용자"].isin(ADMINS)]
+    if "시간" in df.columns:
+        df = df.sort_values("시간")
+    return df
+
 def process_excel(df, manual_buyer_ids):
     try:
         # 필수 컬럼 확인
@@ -235,59 +195,82 @@ def process_excel(df, manual_buyer_ids):
             return None
 
         # 관리자 메시지만 필터링
-        admins = ["만물다잇쏘", "다잇쏘"]
-        df = df[df["사용자"].isin(admins)]
+        df = filter_admin_messages(df)
 
         if df.empty:
             st.error("관리자(만물다잇쏘, 다잇쏘)의 메시지를 찾을 수 없습니다.")
             return None
-
-        # 메시지를 시간순으로 정렬
-        if "시간" in df.columns:
-            df = df.sort_values("시간")
         
         # 유효한 구매자 목록 생성
         valid_buyers = get_valid_buyers(df, manual_buyer_ids)
-        logging.info(f"유효한 구매자 목록: {valid_buyers}")
+        logging.debug("유효한 구매자 목록: %s", valid_buyers)
+        order_re = build_order_pattern(valid_buyers)
         
-        # 주문 정보 처리
-        all_orders = []
+        # 주문 정보 처리 (컬럼별 리스트에 바로 추가)
+        buyers_col = []
+        product_numbers_col = []
+        product_names_col = []
+        prices_col = []
+        quantities_col = []
 
-        for _, row in df.iterrows():
-            msg = str(row["메시지"]).strip() if pd.notna(row["메시지"]) else ""
-            if not msg:
-                continue
+        msgs = df["메시지"].dropna().astype(str).str.strip()
+        msgs = msgs[msgs.str.contains('/', regex=False)]
 
-            logging.info(f"처리 중인 메시지: {msg}")
+        # 같은 메시지가 반복되는 경우가 많으므로 중복을 제거한 메시지만 파싱
+        unique_msgs = msgs.drop_duplicates()
 
-            # 상품 정보와 주문 정보 추출
-            product_number, product_name, price = extract_product_info(msg)
-            
-            if product_number and product_name and price and '/' in msg:
-                orders = parse_order_info(msg, valid_buyers)
-                
-                for buyer, quantity in orders:
-                    order = {
-                        "구매자": buyer,
-                        "상품번호": product_number,
-                        "상품명": product_name,
-                        "판매가": price,
-                        "수량": quantity
-                    }
-                    all_orders.append(order)
-                    logging.info(f"주문 처리: {buyer} - {product_name} {quantity}개")
-
-        if not all_orders:
-            st.warning("처리된 주문 내역이 없습니다.")
-            if st.checkbox("처리된 메시지 보기"):
-                st.write("### 처리된 메시지 목록")
-                messages = df["메시지"].dropna().tolist()
-                for msg in messages:
-                    st.text(msg)
-            return None
+        # 마지막 '/'에서 한 번만 나누어 상품 정보(앞부분)와 주문 정보(뒷부분)에 사용
+        # ('블랙/화이트'처럼 앞부분에 '/'가 더 있어도 그 뒤의 가격을 찾을 수 있도록 앞부분은
+        # 전부 전달하며, 상품명은 clean_product_name에서 여전히 첫 '/' 앞까지만 사용)
+        parts = unique_msgs.str.rpartition('/', expand=False)
+        heads = parts.str[0].str.strip()
+        tails = parts.str[2].str.strip()
+
+        # 상품 정보 일괄 추출
+        products = extract_product_info(heads)
+
+        # 메시지별 주문 목록 (반복문에서 pandas 인덱싱을 하지 않도록 미리 파이썬 리스트로 변환)
+        parse_cache = {}
+        for msg, order_part, product_number, product_name, price in zip(
+            unique_msgs[products.index].tolist(),
+            tails[products.index].tolist(),
+            products["상품번호"].tolist(),
+            products["상품명"].tolist(),
+            products["판매가"].tolist()
+        ):
+            logging.debug("처리 중인 주문: %s", order_part)
+
+            # 주문 정보 추출
+            orders = parse_order_info(order_part, order_re)
+            if orders:
+                buyers, quantities = zip(*orders)
+                parse_cache[msg] = (product_number, product_name, price, buyers, quantities)
 
-        # 데이터프레임 생성 및 정렬
-        df_orders = pd.DataFrame(all_orders)
+        # 원래 메시지 순서대로 주문 내역 생성 (반복된 메시지도 각각 주문으로 처리)
+        for msg in msgs.tolist():
+            cached = parse_cache.get(msg)
+            if cached is None:
+                continue
+            product_number, product_name, price, buyers, quantities = cached
+            count = len(buyers)
+            buyers_col.extend(buyers)
+            product_numbers_col.extend([product_number] * count)
+            product_names_col.extend([product_name] * count)
+            prices_col.extend([price] * count)
+            quantities_col.extend(quantities)
+
+        logging.info("처리 완료: %d주문", len(buyers_col))
+
+        # 데이터프레임 생성 및 정렬 (주문이 없으면 빈 데이터프레임)
+        df_orders = pd.DataFrame({
+            "구매자": buyers_col,
+            "상품번호": product_numbers_col,
+            "상품명": product_names_col,
+            "판매가": prices_col,
+            "수량": quantities_col
+        })
+        # 판매가는 최대 6자리이므로 int32, 채팅에 자유롭게 입력되는 상품번호/수량은 그대로 유지
+        df_orders = df_orders.astype({"구매자": "category", "상품명": "category", "판매가": "int32"})
         df_orders = df_orders.sort_values(by=['구매자', '상품번호']).reset_index(drop=True)
         
         return df_orders
@@ -297,6 +280,26 @@ def process_excel(df, manual_buyer_ids):
         st.error(f"데이터 처리 중 오류가 발생했습니다: {str(e)}")
         return None
 
+@st.cache_data(show_spinner=False, max_entries=16)
+def read_chat_excel(file_bytes):
+    """업로드된 채팅 엑셀 파일 읽기"""
+    return pd.read_excel(io.BytesIO(file_bytes), engine="calamine")
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def process_excel_cached(file_bytes, manual_buyer_ids_frozen):
+    """파일 내용과 구매자 아이디가 같으면 이전 처리 결과를 재사용"""
+    df = read_chat_excel(file_bytes)
+    return process_excel(df, set(manual_buyer_ids_frozen))
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_order_excel(df_orders, df_summary):
+    """주문 상세와 구매자별 합계를 엑셀 파일로 저장"""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df_orders.to_excel(writer, sheet_name="주문상세", index=False)
+        df_summary.to_excel(writer, sheet_name="구매자별합계", index=False)
+    return output.getvalue()
+
 def main():
     try:
         st.set_page_config(
@@ -329,7 +332,7 @@ def main():
                 1. 숫자가 포함된 구매자 아이디가 있다면 입력해주세요.
                 2. 유튜브 채팅 내보내기 엑셀 파일을 업로드해주세요.
                 3. 자동으로 주문이 정리되어 표시됩니다.
-                4. 정리된 주문 내역을 엑셀 파일로 다운로드할 수 있습니다.
+                4. 정리된 주문 내역을 엑셀 또는 CSV 파일로 다운로드할 수 있습니다.
             """)
 
         # 저장된 구매자 아이디 불러오기
@@ -371,11 +374,11 @@ def main():
 
         if uploaded_file:
             try:
-                df = pd.read_excel(uploaded_file)
+                file_bytes = uploaded_file.getvalue()
                 logging.info(f"파일 업로드 완료: {uploaded_file.name}")
                 
-                # process_excel 함수 호출 시 manual_buyer_ids 전달
-                df_orders = process_excel(df, manual_buyer_ids)
+                # 파일 내용과 manual_buyer_ids가 같으면 캐시된 결과 사용
+                df_orders = process_excel_cached(file_bytes, frozenset(manual_buyer_ids))
                 
                 if df_orders is not None and not df_orders.empty:
                     # 주문 상세 내역 표시
@@ -395,15 +398,17 @@ def main():
                     )
                     
                     # 구매자별 합계 계산
-                    df_summary = df_orders.copy()
-                    df_summary['구매금액'] = df_summary['판매가'] * df_summary['수량']
-                    df_summary = df_summary.groupby("구매자").agg({
-                        "구매금액": "sum",
-                        "수량": "sum"
-                    }).rename(columns={
-                        "구매금액": "총구매금액",
-                        "수량": "총주문수량"
-                    }).reset_index()
+                    # (수량이 int64 범위를 넘어 object 컬럼이면 파이썬 int로 곱함)
+                    if df_orders['수량'].dtype.kind == 'i':
+                        amounts = df_orders['판매가'].to_numpy(dtype='int64') * df_orders['수량'].to_numpy(dtype='int64')
+                    else:
+                        amounts = df_orders['판매가'].astype(object) * df_orders['수량']
+                    df_summary = df_orders.assign(구매금액=amounts).groupby(
+                        "구매자", sort=False, as_index=False, observed=True
+                    ).agg(
+                        총구매금액=("구매금액", "sum"),
+                        총주문수량=("수량", "sum")
+                    )
                     
                     # 구매자별 합계 표시
                     st.subheader("구매자별 합계")
@@ -417,15 +422,27 @@ def main():
                         hide_index=True,
                     )
 
-                    # 엑셀 저장
-                    output = io.BytesIO()
-                    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-                        df_orders.to_excel(writer, sheet_name="주문상세", index=False)
-                        df_summary.to_excel(writer, sheet_name="구매자별합계", index=False)
-                    output.seek(0)
-
+                    # 엑셀 / CSV 저장
                     st.success("주문 내역이 정리되었습니다 ✅")
-                    st.download_button("📥 정리된 주문 엑셀 다운로드", output, file_name="정리된_주문내역.xlsx")
+                    st.download_button(
+                        "📥 정리된 주문 엑셀 다운로드",
+                        build_order_excel(df_orders, df_summary),
+                        file_name="정리된_주문내역.xlsx"
+                    )
+                    st.download_button(
+                        "📥 주문 상세 CSV 다운로드",
+                        df_orders.to_csv(index=False).encode("utf-8-sig"),
+                        file_name="정리된_주문내역.csv",
+                        mime="text/csv"
+                    )
+
+                elif df_orders is not None:
+                    st.warning("처리된 주문 내역이 없습니다.")
+                    if st.checkbox("처리된 메시지 보기"):
+                        st.write("### 처리된 메시지 목록")
+                        messages = filter_admin_messages(read_chat_excel(file_bytes))["메시지"].dropna().tolist()
+                        for msg in messages:
+                            st.text(msg)
                 
             except Exception as e:
                 logging.error(f"파일 처리 중 오류가 발생했습니다: {str(e)}")